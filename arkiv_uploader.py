@@ -1,8 +1,13 @@
 import os
+import heapq
+import threading
+import requests
 from dotenv import load_dotenv
 from web3 import Web3
 from eth_account import Account
 from arkiv import Arkiv
+from arkiv.types import Operations
+from arkiv.utils import to_create_op
 
 # Load environment variables
 load_dotenv()
@@ -10,15 +15,29 @@ load_dotenv()
 PRIVATE_KEY = os.getenv("PRIVATE_KEY")
 RPC_URL = os.getenv("RPC_URL")
 
+# Shared client, created on first use (keeps the RPC connection alive between uploads)
+_ARKIV_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
 
-def get_arkiv_client() -> Arkiv:
-    """Create and return ARKIV client."""
+# Locally tracked nonce, so parallel uploads from one account never reuse a nonce
+_NEXT_NONCE = None
+_FREE_NONCES = []  # Reserved nonces given back unused (heap, lowest is reused first)
+_NONCE_LOCK = threading.Lock()
+
+# Node errors meaning the nonce was already used, the local counter is behind the node
+NONCE_ERROR_MARKERS = ("nonce too low", "already known", "replacement transaction underpriced")
+
+
+def _create_arkiv_client() -> Arkiv:
+    """Create a new ARKIV client."""
     if not PRIVATE_KEY:
         raise RuntimeError("PRIVATE_KEY not found in .env file")
     if not RPC_URL:
         raise RuntimeError("RPC_URL not found in .env file")
 
-    # Create Web3 provider
+    # Create Web3 provider. It keeps one keep-alive requests.Session per thread, so each
+    # uploader thread reuses its own connections (a session passed in would only
+    # be used by the thread creating the client).
     provider = Web3.HTTPProvider(RPC_URL)
 
     # Create account from private key
@@ -27,6 +46,135 @@ def get_arkiv_client() -> Arkiv:
     return Arkiv(provider=provider, account=account)
 
 
+def get_arkiv_client() -> Arkiv:
+    """Return the shared ARKIV client, creating it on first call."""
+    global _ARKIV_CLIENT
+
+    if _ARKIV_CLIENT is None:
+        with _CLIENT_LOCK:
+            if _ARKIV_CLIENT is None:
+                _ARKIV_CLIENT = _create_arkiv_client()
+    return _ARKIV_CLIENT
+
+
+def _allocate_nonce(arkiv: Arkiv) -> int:
+    """Reserve the next transaction nonce (fetched from the node once, then counted locally)."""
+    global _NEXT_NONCE
+
+    with _NONCE_LOCK:
+        if _FREE_NONCES:
+            return heapq.heappop(_FREE_NONCES)
+        if _NEXT_NONCE is None:
+            _NEXT_NONCE = arkiv.eth.get_transaction_count(arkiv.eth.default_account, "pending")
+        nonce = _NEXT_NONCE
+        _NEXT_NONCE += 1
+        return nonce
+
+
+def _release_nonce(arkiv: Arkiv, nonce: int):
+    """Give back a reserved nonce whose transaction failed, so later nonces don't wait on a gap.
+
+    execute() sends the transaction before waiting for its receipt, so a failure
+    (receipt timeout, reverted transaction, rate limited polling) can come after
+    the node took the nonce. It is only given back while the node's pending
+    count hasn't reached it - otherwise, or if the node can't be asked, it stays used.
+    """
+    try:
+        node_nonce = arkiv.eth.get_transaction_count(arkiv.eth.default_account, "pending")
+    except Exception:
+        return
+    if nonce < node_nonce:
+        return
+    with _NONCE_LOCK:
+        heapq.heappush(_FREE_NONCES, nonce)
+
+
+def _resync_nonce(arkiv: Arkiv):
+    """Catch up with the node after a nonce error.
+
+    Never moves below nonces already handed out to other workers - those
+    transactions may still be on their way to the node.
+    """
+    global _NEXT_NONCE
+
+    node_nonce = arkiv.eth.get_transaction_count(arkiv.eth.default_account, "pending")
+    with _NONCE_LOCK:
+        _NEXT_NONCE = node_nonce if _NEXT_NONCE is None else max(_NEXT_NONCE, node_nonce)
+        # Given-back nonces the node has seen used are gone for good
+        _FREE_NONCES[:] = [nonce for nonce in _FREE_NONCES if nonce >= node_nonce]
+        heapq.heapify(_FREE_NONCES)
+
+
+def is_nonce_error(error: Exception) -> bool:
+    """Check if an upload error says the transaction nonce was already used."""
+    message = str(error).lower()
+    return any(marker in message for marker in NONCE_ERROR_MARKERS)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """Check if an upload error is an HTTP 429 from the RPC endpoint."""
+    response = getattr(error, "response", None)
+    return isinstance(error, requests.HTTPError) and response is not None and response.status_code == 429
+
+
+def upload_images_to_arkiv(images: list[dict], app_name: str = "CCats") -> list[dict]:
+    """
+    Upload several images to ARKIV blockchain in a single transaction.
+
+    Args:
+        images: List of dicts with image_data, prompt, image_id and content_type
+        app_name: Application name for ARKIV attributes
+
+    Returns:
+        list of dicts with entityKey and txHash, in the same order as images
+    """
+    arkiv = get_arkiv_client()
+    expires_in = arkiv.arkiv.to_seconds(days=128)  # 128 days expiration
+
+    # One create operation per image, image as payload
+    creates = [
+        to_create_op(
+            payload=image["image_data"],
+            content_type=image["content_type"],
+            attributes={
+                "type": "image",
+                "app": app_name,
+                "prompt": image["prompt"][:500],  # Limit prompt length
+                "id": image["image_id"],
+            },
+            expires_in=expires_in,
+        )
+        for image in images
+    ]
+
+    nonce = _allocate_nonce(arkiv)
+    try:
+        receipt = arkiv.arkiv.execute(
+            Operations(creates=creates),
+            tx_params={"nonce": nonce},
+        )
+    except Exception as e:
+        if is_nonce_error(e):
+            # Nonce is used up, catch up with the node
+            _resync_nonce(arkiv)
+        else:
+            # Reuse the nonce unless the node already has the transaction
+            _release_nonce(arkiv, nonce)
+        raise
+
+    if len(receipt.creates) != len(images):
+        raise RuntimeError(f"Expected {len(images)} created entities, got {len(receipt.creates)}")
+
+    return [
+        {
+            "success": True,
+            "entityKey": event.key,
+            "txHash": receipt.tx_hash,
+        }
+        for event in receipt.creates
+    ]
+
+
 def upload_image_to_arkiv(
     image_data: bytes,
     prompt: str,
@@ -47,26 +195,13 @@ def upload_image_to_arkiv(
     Returns:
         dict with entityKey and txHash
     """
-    arkiv = get_arkiv_client()
-
-    # Create entity with image as payload
-    entity_key, tx_hash = arkiv.arkiv.create_entity(
-        payload=image_data,
-        content_type=content_type,
-        attributes={
-            "type": "image",
-            "app": app_name,
-            "prompt": prompt[:500],  # Limit prompt length
-            "id": image_id,
-        },
-        expires_in=arkiv.arkiv.to_seconds(days=128),  # 128 days expiration
-    )
-
-    return {
-        "success": True,
-        "entityKey": entity_key,
-        "txHash": tx_hash,
+    image = {
+        "image_data": image_data,
+        "prompt": prompt,
+        "image_id": image_id,
+        "content_type": content_type,
     }
+    return upload_images_to_arkiv([image], app_name)[0]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,79 @@
+import io
+from PIL import Image
+
+# JPEG quality steps tried in order until the image fits
+JPEG_QUALITY_STEPS = (90, 80, 70, 60, 50, 40)
+
+# Width used when quality steps alone are not enough
+MAX_WIDTH = 800
+
+
+def _encode_png_quantized(img: Image.Image) -> bytes:
+    """Encode image as 256-color optimized PNG."""
+    buf = io.BytesIO()
+    img.quantize(colors=256).save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def _encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    """Encode image as progressive optimized JPEG."""
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def to_jpeg(img_bytes: bytes, quality: int = 90) -> bytes:
+    """Convert image bytes (e.g. ComfyUI's PNG output) to a progressive JPEG."""
+    img = Image.open(io.BytesIO(img_bytes))
+    return _encode_jpeg(img.convert("RGB"), quality)
+
+
+def compress_to_budget(img_bytes: bytes, max_kb: int = 117) -> tuple[bytes, str]:
+    """
+    Re-encode an image so it fits into max_kb.
+
+    Tries a 256-color PNG first (PNG input only), then JPEG with decreasing
+    quality, then the same JPEG steps with the image downscaled to MAX_WIDTH.
+
+    Args:
+        img_bytes: Raw image bytes (PNG or JPEG)
+        max_kb: Size budget in kilobytes
+
+    Returns:
+        tuple of (image bytes, content type). If nothing fits, the smallest
+        attempt is returned - the caller decides whether to skip the upload.
+    """
+    max_bytes = max_kb * 1024
+    img = Image.open(io.BytesIO(img_bytes))
+    img.load()
+
+    if len(img_bytes) <= max_bytes:
+        content_type = "image/png" if img.format == "PNG" else "image/jpeg"
+        return img_bytes, content_type
+
+    best = (img_bytes, "image/png" if img.format == "PNG" else "image/jpeg")
+
+    # 1. PNG with 256-color palette
+    if img.format == "PNG":
+        data = _encode_png_quantized(img)
+        if len(data) <= max_bytes:
+            return data, "image/png"
+        if len(data) < len(best[0]):
+            best = (data, "image/png")
+
+    # 2. JPEG quality steps, then again at reduced width
+    rgb = img.convert("RGB")
+    candidates = [rgb]
+    if rgb.width > MAX_WIDTH:
+        height = round(rgb.height * MAX_WIDTH / rgb.width)
+        candidates.append(rgb.resize((MAX_WIDTH, height), Image.LANCZOS))
+
+    for candidate in candidates:
+        for quality in JPEG_QUALITY_STEPS:
+            data = _encode_jpeg(candidate, quality)
+            if len(data) <= max_bytes:
+                return data, "image/jpeg"
+            if len(data) < len(best[0]):
+                best = (data, "image/jpeg")
+
+    return best
@@ -1,11 +1,16 @@
-import json
 import uuid
 import time
 import os
 import threading
 import queue
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Optional
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from websocket import create_connection
 from dotenv import load_dotenv
 
@@ -14,11 +19,9 @@ load_dotenv()
 
 from prompt_generator import (
     seed_database,
-    get_next_prompt,
-    mark_in_progress,
+    claim_next_prompt,
     mark_completed,
     mark_failed,
-    mark_generated,
     get_stats,
     reset_in_progress,
     reset_interrupted,
@@ -27,8 +30,12 @@ from prompt_generator import (
     get_theme,
     get_output_prefix,
     get_app_name,
+    status_batcher,
+    close_readers,
+    close_pools,
 )
-from arkiv_uploader import upload_image_to_arkiv
+from arkiv_uploader import upload_image_to_arkiv, upload_images_to_arkiv, is_rate_limited
+from image_compress import compress_to_budget, to_jpeg
 
 # ComfyUI configuration (from .env)
 COMFY_HOST = os.getenv("COMFY_HOST", "192.168.0.122")
@@ -37,6 +44,23 @@ COMFY_PORT = int(os.getenv("COMFY_PORT", "8899"))
 BASE_URL = f"http://{COMFY_HOST}:{COMFY_PORT}"
 WS_URL = f"ws://{COMFY_HOST}:{COMFY_PORT}/ws"
 
+# Theme settings (from .env, fixed for the whole run)
+THEME = get_theme()
+APP_NAME = get_app_name()
+OUTPUT_PREFIX = get_output_prefix()
+
+# Persistent HTTP session for ComfyUI (keep-alive between /prompt and /view calls).
+# Retry covers idempotent requests only (GET /view), POST /prompt is never resent.
+_COMFY = requests.Session()
+_COMFY.mount("http://", HTTPAdapter(
+    pool_connections=2,
+    pool_maxsize=10,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=(502, 503, 504)),
+))
+
+# WebSocket message types wait_for_images() cares about (everything else is skipped unparsed)
+WS_WANTED_TYPES = ('"executed"', '"execution_success"', '"execution_complete"')
+
 # Workflow file name located next to this script
 WORKFLOW_JSON = "workflow.json"
 
@@ -47,18 +71,26 @@ WORKFLOW_JSON = "workflow.json"
 # - the dictionary key above that fragment is the node ID, e.g. "7"
 PROMPT_NODE_ID = "6"
 
-# Delay between generations (seconds)
+# Delay between generations (seconds, endless mode only)
 DELAY_BETWEEN_GENERATIONS = 2
 
+# Generated images are saved as JPEG with this quality (ComfyUI returns large PNGs)
+OUTPUT_JPEG_QUALITY = 90
+
 # ARKIV settings
-MAX_IMAGE_SIZE_KB = 117
+MAX_IMAGE_SIZE_KB = 117  # Larger images are recompressed (JPEG/resize) to fit before upload
 UPLOAD_TO_ARKIV = True
 MAX_UPLOAD_RETRIES = 3   # Number of retry attempts for failed uploads
-RETRY_DELAY = 30         # Seconds to wait between retries
+RETRY_DELAY = 30         # Seconds to wait between retries (doubled per attempt when rate limited)
+UPLOAD_BATCH_SIZE = 8    # Max images per ARKIV transaction (waiting images are uploaded together)
+ENTITY_OVERHEAD_KB = 1   # Per-image transaction overhead besides the payload (prompt up to 500 chars, other attributes)
+# Max transaction size per batch, counting ENTITY_OVERHEAD_KB per image - never larger than a single max-size image
+UPLOAD_BATCH_KB = MAX_IMAGE_SIZE_KB + ENTITY_OVERHEAD_KB
 
 # Threading settings
 UPLOAD_QUEUE_SIZE = 0    # 0 = unlimited queue (generator runs at full GPU speed)
-UPLOADER_THREADS = 1     # Number of parallel upload threads (ARKIV is slow)
+UPLOADER_THREADS = 4     # Upload worker pool size = max ARKIV transactions in flight (keep within RPC provider limits)
+STATS_EVERY = 10         # Generator re-reads progress from the DB every N images (counted locally in between)
 
 
 # =============================================================================
@@ -72,6 +104,8 @@ class GeneratedImage:
     prompt_text: str
     image_path: str
     image_id: int
+    image_bytes: Optional[bytes] = None  # None = read from image_path (oversized images, items from previous run)
+    content_type: str = "image/jpeg"
 
 
 # Thread-safe queue for communication between threads
@@ -131,30 +165,42 @@ def get_upload_stats_summary(last_upload_time: float = None) -> str:
 # =============================================================================
 
 def load_workflow() -> dict:
-    with open(WORKFLOW_JSON, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(WORKFLOW_JSON, "rb") as f:
+        workflow = orjson.loads(f.read())
 
+    if PROMPT_NODE_ID not in workflow:
+        raise KeyError(f"Node with id {PROMPT_NODE_ID} not found in workflow.json")
 
-def set_prompt(workflow: dict, node_id: str, prompt: str) -> dict:
-    # Deep copy to avoid modifying the original
-    wf = json.loads(json.dumps(workflow))
-    if node_id not in wf:
-        raise KeyError(f"Node with id {node_id} not found in workflow.json")
+    if "inputs" not in workflow[PROMPT_NODE_ID] or "text" not in workflow[PROMPT_NODE_ID]["inputs"]:
+        raise KeyError(f"Node {PROMPT_NODE_ID} does not have inputs.text field")
+
+    return workflow
 
-    if "inputs" not in wf[node_id] or "text" not in wf[node_id]["inputs"]:
-        raise KeyError(f"Node {node_id} does not have inputs.text field")
 
-    wf[node_id]["inputs"]["text"] = prompt
+def set_prompt(workflow: dict, node_id: str, prompt: str) -> dict:
+    # Copy only the path down to the prompt text, the rest is shared with the original
+    wf = dict(workflow)
+    node = dict(wf[node_id])
+    node["inputs"] = {**node["inputs"], "text": prompt}
+    wf[node_id] = node
     return wf
 
 
+# Workflow is loaded and validated once, each generation only swaps the prompt
+_WORKFLOW = load_workflow()
+
+
 def send_prompt_to_comfy(workflow: dict, client_id: str):
     payload = {
         "prompt": workflow,
         "client_id": client_id,
     }
 
-    resp = requests.post(f"{BASE_URL}/prompt", json=payload)
+    resp = _COMFY.post(
+        f"{BASE_URL}/prompt",
+        data=orjson.dumps(payload),
+        headers={"Content-Type": "application/json"},
+    )
     resp.raise_for_status()
     data = resp.json()
     prompt_id = data.get("prompt_id")
@@ -180,7 +226,11 @@ def wait_for_images(ws, prompt_id: str, timeout: int = 300):
         if not msg:
             continue
 
-        data = json.loads(msg)
+        # Skip binary frames (previews) and progress/status messages without parsing them
+        if isinstance(msg, bytes) or not any(t in msg for t in WS_WANTED_TYPES):
+            continue
+
+        data = orjson.loads(msg)
 
         msg_type = data.get("type")
         msg_data = data.get("data", {})
@@ -207,100 +257,124 @@ def wait_for_images(ws, prompt_id: str, timeout: int = 300):
     return images
 
 
-def download_image(image_info: dict, out_path: str):
+def download_image(image_info: dict) -> bytes:
     params = {
         "filename": image_info["filename"],
         "subfolder": image_info.get("subfolder", ""),
         "type": image_info.get("type", "output"),
     }
 
-    resp = requests.get(f"{BASE_URL}/view", params=params, stream=True)
+    resp = _COMFY.get(f"{BASE_URL}/view", params=params, stream=True)
     resp.raise_for_status()
 
-    with open(out_path, "wb") as f:
-        for chunk in resp.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
+    buf = bytearray()
+    for chunk in resp.iter_content(chunk_size=65536):
+        if chunk:
+            buf += chunk
 
-    print("Image saved:", out_path)
+    return bytes(buf)
 
 
-def upload_to_arkiv(image_path: str, prompt: str, image_id: int) -> dict:
-    """Upload image to ARKIV blockchain."""
+def get_content_type(image_path: str) -> str:
+    """Determine image content type from file extension."""
+    ext = os.path.splitext(image_path)[1].lower()
+    return "image/png" if ext == ".png" else "image/jpeg"
 
-    print(f"Uploading to ARKIV: {image_path}")
 
-    # Read image data
-    with open(image_path, "rb") as f:
-        image_data = f.read()
+def upload_to_arkiv(image_data: bytes, prompt: str, image_id: int, content_type: str) -> dict:
+    """Upload image to ARKIV blockchain."""
 
-    # Determine content type
-    ext = os.path.splitext(image_path)[1].lower()
-    content_type = "image/png" if ext == ".png" else "image/jpeg"
+    print(f"Uploading to ARKIV: ID {image_id}")
 
     size_kb = len(image_data) / 1024
-    app_name = get_app_name()
-    print(f"Image size: {size_kb:.2f}KB, Content-Type: {content_type}, App: {app_name}")
+    print(f"Image size: {size_kb:.2f}KB, Content-Type: {content_type}, App: {APP_NAME}")
 
     # Upload to ARKIV
-    result = upload_image_to_arkiv(image_data, prompt, image_id, content_type, app_name)
+    result = upload_image_to_arkiv(image_data, prompt, image_id, content_type, APP_NAME)
 
     print(f"ARKIV upload success! Entity: {result.get('entityKey')}")
     return result
 
 
-def generate_image_only(prompt_text: str, image_id: int) -> str:
+def upload_batch_to_arkiv(batch: list) -> list:
+    """Upload prepared GeneratedImage items to ARKIV in a single transaction."""
+
+    size_kb = sum(len(item.image_bytes) for item in batch) / 1024
+    print(f"Uploading {len(batch)} image(s) to ARKIV: {size_kb:.2f}KB, App: {APP_NAME}")
+
+    results = upload_images_to_arkiv(
+        [
+            {
+                "image_data": item.image_bytes,
+                "prompt": item.prompt_text,
+                "image_id": item.image_id,
+                "content_type": item.content_type,
+            }
+            for item in batch
+        ],
+        APP_NAME,
+    )
+
+    print(f"ARKIV upload success! Entities: {', '.join(str(r.get('entityKey')) for r in results)}")
+    return results
+
+
+def generate_image_only(prompt_text: str, image_id: int) -> tuple[str, bytes]:
     """Generate image using ComfyUI (GPU work only, no upload).
 
     Used by threaded mode - upload is handled by separate uploader thread.
+    Returns the saved file path and the image bytes (so they are not re-read for upload).
     """
-    # 1. Load workflow
-    workflow = load_workflow()
+    # 1. Replace prompt in the preloaded workflow
+    workflow = set_prompt(_WORKFLOW, PROMPT_NODE_ID, prompt_text)
 
-    # 2. Replace prompt
-    workflow = set_prompt(workflow, PROMPT_NODE_ID, prompt_text)
-
-    # 3. Generate client_id and connect WebSocket BEFORE sending prompt
+    # 2. Generate client_id and connect WebSocket BEFORE sending prompt
     client_id = str(uuid.uuid4())
     ws_url_with_client = f"{WS_URL}?clientId={client_id}"
     print(f"Connecting to WebSocket: {ws_url_with_client}")
-    ws = create_connection(ws_url_with_client)
+    ws = create_connection(ws_url_with_client, skip_utf8_validation=True)
 
     try:
-        # 4. Send workflow to ComfyUI
+        # 3. Send workflow to ComfyUI
         prompt_id = send_prompt_to_comfy(workflow, client_id)
 
-        # 5. Wait for images via WebSocket
+        # 4. Wait for images via WebSocket
         images = wait_for_images(ws, prompt_id)
     finally:
         ws.close()
 
-    # 6. Download first image and save as PNG
+    # 5. Download first image and save as JPEG
     os.makedirs("output", exist_ok=True)
     img_info = images[0]
-    prefix = get_output_prefix()
-    out_path = f"output/{prefix}_{image_id}.png"
-    download_image(img_info, out_path)
+    out_path = f"output/{OUTPUT_PREFIX}_{image_id}.jpg"
+    image_data = to_jpeg(download_image(img_info), OUTPUT_JPEG_QUALITY)
+    Path(out_path).write_bytes(image_data)
+    print("Image saved:", out_path)
 
-    return out_path
+    return out_path, image_data
 
 
 def generate_image(prompt_text: str, image_id: int) -> str:
     """Generate image and upload to ARKIV (legacy single-threaded mode)."""
     # Generate the image
-    out_path = generate_image_only(prompt_text, image_id)
+    out_path, image_data = generate_image_only(prompt_text, image_id)
 
     # Upload to ARKIV if enabled
     if UPLOAD_TO_ARKIV:
-        # Check image size
-        image_size_kb = os.path.getsize(out_path) / 1024
+        # Check image size, recompress if over budget
+        content_type = get_content_type(out_path)
+        image_size_kb = len(image_data) / 1024
+        if image_size_kb > MAX_IMAGE_SIZE_KB:
+            image_data, content_type = compress_to_budget(image_data, MAX_IMAGE_SIZE_KB)
+            print(f"Compressed for ARKIV: {image_size_kb:.2f}KB -> {len(image_data) / 1024:.2f}KB ({content_type})")
+            image_size_kb = len(image_data) / 1024
 
         if image_size_kb > MAX_IMAGE_SIZE_KB:
             print(f"Image too large for ARKIV ({image_size_kb:.2f}KB > {MAX_IMAGE_SIZE_KB}KB), skipping upload")
         else:
             # Upload to ARKIV
             try:
-                upload_to_arkiv(out_path, prompt_text, image_id)
+                upload_to_arkiv(image_data, prompt_text, image_id, content_type)
             except Exception as e:
                 print(f"ARKIV upload failed (continuing anyway): {e}")
 
@@ -320,9 +394,17 @@ def generator_thread():
     thread_name = threading.current_thread().name
     print(f"[{thread_name}] Started")
 
+    # The next prompt is claimed in the background while the GPU works on the current one
+    db_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="DB-Prefetch")
+    next_future = db_pool.submit(claim_next_prompt)
+
+    # Progress counter, synced from the DB every STATS_EVERY images
+    iteration = 0
+    done = total = 0
+
     while not shutdown_event.is_set():
-        # Get next pending prompt
-        item = get_next_prompt()
+        # Get next pending prompt, already marked in progress (claimed during the previous generation)
+        item = next_future.result()
 
         if not item:
             # No more prompts - signal done and exit
@@ -333,19 +415,24 @@ def generator_thread():
         prompt_text = item["prompt"]
         image_id = prompt_id
 
-        stats = get_stats()
-        print(f"\n[{thread_name}] [{stats['completed'] + stats['generated'] + 1}/{stats['total']}] Generating...")
+        if iteration % STATS_EVERY == 0:
+            stats = get_stats()
+            done = stats['completed'] + stats['generated']
+            total = stats['total']
+        iteration += 1
+        done += 1
+        print(f"\n[{thread_name}] [{done}/{total}] Generating...")
         print(f"[{thread_name}] Prompt: {prompt_text[:70]}...")
 
-        # Mark as in progress
-        mark_in_progress(prompt_id)
+        # Claim the prompt after this one
+        next_future = db_pool.submit(claim_next_prompt)
 
         try:
             # Generate image (GPU work only)
-            output_path = generate_image_only(prompt_text, image_id)
+            output_path, image_data = generate_image_only(prompt_text, image_id)
 
             # Mark as generated in DB
-            mark_generated(prompt_id, output_path)
+            status_batcher.mark(prompt_id, "generated", output_path)
 
             # Queue for upload (blocks if queue is full - backpressure)
             if UPLOAD_TO_ARKIV:
@@ -353,12 +440,15 @@ def generator_thread():
                     prompt_id=prompt_id,
                     prompt_text=prompt_text,
                     image_path=output_path,
-                    image_id=image_id
+                    image_id=image_id,
+                    # Oversized images are not kept in memory while queued, they get re-read for compression
+                    image_bytes=image_data if len(image_data) <= MAX_IMAGE_SIZE_KB * 1024 else None,
+                    content_type=get_content_type(output_path)
                 ))
                 print(f"[{thread_name}] Queued for upload: {output_path}")
             else:
                 # No upload - mark as completed directly
-                mark_completed(prompt_id, output_path)
+                status_batcher.mark(prompt_id, "completed", output_path)
                 print(f"[{thread_name}] SUCCESS (no upload): {output_path}")
 
         except Exception as e:
@@ -366,88 +456,224 @@ def generator_thread():
             mark_failed(prompt_id)
             # Continue with next prompt
 
+    # Give back a prompt claimed ahead but not generated (on shutdown)
+    leftover = next_future.result()
+    if leftover:
+        mark_failed(leftover["id"])
+
+    db_pool.shutdown(wait=True)
+    status_batcher.flush()
     print(f"[{thread_name}] Finished")
 
 
-def uploader_thread():
-    """Thread 2: Uploads images to ARKIV (network I/O).
+def prepare_upload(item: GeneratedImage, thread_name: str):
+    """Load image bytes and recompress them if over MAX_IMAGE_SIZE_KB.
+
+    Returns a copy of the item carrying the bytes to upload, or None if the
+    image still doesn't fit (then it is marked completed and counted as skipped).
+    """
+    # Use image bytes passed from the generator, oversized and reloaded items are read from disk
+    image_data = item.image_bytes
+    if image_data is None:
+        image_data = Path(item.image_path).read_bytes()
+    image_size_kb = len(image_data) / 1024
+
+    # Recompress if over budget
+    content_type = item.content_type
+    if image_size_kb > MAX_IMAGE_SIZE_KB:
+        image_data, content_type = compress_to_budget(image_data, MAX_IMAGE_SIZE_KB)
+        print(f"[{thread_name}] Compressed: {image_size_kb:.2f}KB -> {len(image_data) / 1024:.2f}KB ({content_type})")
+        image_size_kb = len(image_data) / 1024
+
+    if image_size_kb > MAX_IMAGE_SIZE_KB:
+        print(f"[{thread_name}] Image too large ({image_size_kb:.2f}KB > {MAX_IMAGE_SIZE_KB}KB), skipping upload")
+        status_batcher.mark(item.prompt_id, "completed", item.image_path)
+        with upload_stats_lock:
+            upload_stats["skipped"] += 1
+        print(f"[{thread_name}] >>> ARKIV SKIP  | ID: {item.image_id} | Too large <<<")
+        print(f"[{thread_name}] {get_upload_stats_summary()}")
+        return None
+
+    return replace(item, image_bytes=image_data, content_type=content_type)
+
+
+def wait_for_retry(error: Exception, attempt: int, thread_name: str) -> bool:
+    """Sleep before the next upload attempt. Returns False if shutdown was requested meanwhile."""
+    # Back off exponentially when the RPC endpoint rate limits us
+    retry_delay = RETRY_DELAY * 2 ** (attempt - 1) if is_rate_limited(error) else RETRY_DELAY
+    print(f"[{thread_name}]     Retry in {retry_delay}s...")
+    # Wait with periodic shutdown checks
+    for _ in range(retry_delay):
+        if shutdown_event.is_set():
+            return False
+        time.sleep(1)
+    return not shutdown_event.is_set()
+
+
+def give_up_upload(batch: list, thread_name: str):
+    """Mark images back to 'generated', they are uploaded again on next run."""
+    ids = ", ".join(str(item.image_id) for item in batch)
+    print(f"[{thread_name}] !!! ARKIV GAVE UP | ID: {ids} | Will retry on next run !!!")
+    for item in batch:
+        status_batcher.mark(item.prompt_id, "generated", item.image_path)
+
+
+def upload_with_retries(batch: list, thread_name: str, max_attempts: int):
+    """Upload prepared images in one ARKIV transaction, up to max_attempts times.
+
+    Returns None on success, otherwise the last error.
+    """
+    ids = ", ".join(str(item.image_id) for item in batch)
+
+    error = None
+    for attempt in range(1, max_attempts + 1):
+        try:
+            print(f"[{thread_name}] Uploading (attempt {attempt}/{max_attempts}): ID {ids}")
+            upload_start = time.time()
+            upload_batch_to_arkiv(batch)
+            last_upload_time = time.time() - upload_start
+
+            for item in batch:
+                status_batcher.mark(item.prompt_id, "completed", item.image_path)
+            with upload_stats_lock:
+                upload_stats["successful"] += len(batch)
+                upload_stats["total_attempts"] += attempt * len(batch)
+                upload_stats["upload_times"].append(last_upload_time)
+                # Keep only last 100 times
+                if len(upload_stats["upload_times"]) > 100:
+                    upload_stats["upload_times"] = upload_stats["upload_times"][-100:]
+
+            print(f"[{thread_name}] >>> ARKIV OK    | ID: {ids} | {last_upload_time:.1f}s <<<")
+            print(f"[{thread_name}] {get_upload_stats_summary(last_upload_time)}")
+            return None
+        except Exception as e:
+            error = e
+            with upload_stats_lock:
+                upload_stats["failed"] += len(batch)
+                upload_stats["total_attempts"] += len(batch)
+            print(f"[{thread_name}] !!! ARKIV FAIL  | ID: {ids} | Attempt {attempt}/{max_attempts} | {e}")
+            print(f"[{thread_name}] {get_upload_stats_summary()}")
+            if attempt < max_attempts and not wait_for_retry(e, attempt, thread_name):
+                break
+
+    return error
+
+
+def upload_batch(batch: list, thread_name: str):
+    """Upload prepared images to ARKIV, with retry logic.
 
-    Takes generated images from queue and uploads them to ARKIV blockchain.
+    A batch gets one attempt as a single transaction. If that fails, its
+    images are uploaded one by one with the usual retries, so one image that
+    can't be uploaded doesn't send the whole batch back to 'generated'.
+    """
+    if len(batch) > 1:
+        error = upload_with_retries(batch, thread_name, max_attempts=1)
+        if error is None:
+            return
+        print(f"[{thread_name}] Batch failed, uploading its {len(batch)} images one by one")
+        if not wait_for_retry(error, 1, thread_name):
+            give_up_upload(batch, thread_name)
+            return
+
+    for index, item in enumerate(batch):
+        if shutdown_event.is_set():
+            give_up_upload(batch[index:], thread_name)
+            return
+        if upload_with_retries([item], thread_name, MAX_UPLOAD_RETRIES) is not None:
+            give_up_upload([item], thread_name)
+
+
+def process_upload(batch: list, upload_slots: threading.BoundedSemaphore):
+    """Upload worker task: upload one batch, then release its queue items and worker slot."""
+    try:
+        upload_batch(batch, threading.current_thread().name)
+    finally:
+        for _ in batch:
+            upload_queue.task_done()
+        upload_slots.release()
+
+
+def upload_dispatcher(upload_pool: ThreadPoolExecutor, upload_slots: threading.BoundedSemaphore):
+    """Thread 2: Hands generated images to the upload worker pool (network I/O).
+
+    Waits for a free worker, then takes images from the queue and packs the
+    ones already waiting into one transaction, up to UPLOAD_BATCH_SIZE images
+    and UPLOAD_BATCH_KB of payload plus per-image overhead. Images queue up while all workers are busy,
+    so batches fill naturally when ARKIV is slow.
+
+    Blocks on the queue until an item arrives, a None sentinel ends the loop.
     """
     thread_name = threading.current_thread().name
     print(f"[{thread_name}] Started")
 
-    while not shutdown_event.is_set() or not upload_queue.empty():
-        try:
-            # Get next item with timeout (to check shutdown_event periodically)
-            item = upload_queue.get(timeout=1.0)
-        except queue.Empty:
-            continue
+    # Prepared item taken from the queue that did not fit into the previous batch
+    carry = None
+    finished = False
+
+    while not finished:
+        # Wait for a free upload worker
+        upload_slots.acquire()
+
+        batch = [carry] if carry else []
+        carry = None
+        batch_bytes = sum(len(item.image_bytes) + ENTITY_OVERHEAD_KB * 1024 for item in batch)
+
+        while len(batch) < UPLOAD_BATCH_SIZE:
+            try:
+                if batch:
+                    # Only add images that are already waiting
+                    item = upload_queue.get_nowait()
+                else:
+                    item = upload_queue.get()
+            except queue.Empty:
+                break
+
+            if item is None or shutdown_event.is_set():
+                # Sentinel or interrupted - stop taking items, the rest stay 'generated' for next run
+                upload_queue.task_done()
+                finished = True
+                break
 
-        try:
             # Initialize start time on first upload
             with upload_stats_lock:
                 if upload_stats["start_time"] is None:
                     upload_stats["start_time"] = time.time()
 
-            # Check image size
-            image_size_kb = os.path.getsize(item.image_path) / 1024
-            last_upload_time = None
-
-            if image_size_kb > MAX_IMAGE_SIZE_KB:
-                print(f"[{thread_name}] Image too large ({image_size_kb:.2f}KB > {MAX_IMAGE_SIZE_KB}KB), skipping upload")
-                mark_completed(item.prompt_id, item.image_path)
-                with upload_stats_lock:
-                    upload_stats["skipped"] += 1
-                print(f"[{thread_name}] >>> ARKIV SKIP  | ID: {item.image_id} | Too large <<<")
-                print(f"[{thread_name}] {get_upload_stats_summary()}")
-            else:
-                # Upload to ARKIV with retry logic
-                upload_success = False
-                for attempt in range(1, MAX_UPLOAD_RETRIES + 1):
-                    try:
-                        print(f"[{thread_name}] Uploading (attempt {attempt}/{MAX_UPLOAD_RETRIES}): ID {item.image_id}")
-                        upload_start = time.time()
-                        upload_to_arkiv(item.image_path, item.prompt_text, item.image_id)
-                        last_upload_time = time.time() - upload_start
-
-                        mark_completed(item.prompt_id, item.image_path)
-                        with upload_stats_lock:
-                            upload_stats["successful"] += 1
-                            upload_stats["total_attempts"] += attempt
-                            upload_stats["upload_times"].append(last_upload_time)
-                            # Keep only last 100 times
-                            if len(upload_stats["upload_times"]) > 100:
-                                upload_stats["upload_times"] = upload_stats["upload_times"][-100:]
-
-                        print(f"[{thread_name}] >>> ARKIV OK    | ID: {item.image_id} | {last_upload_time:.1f}s <<<")
-                        print(f"[{thread_name}] {get_upload_stats_summary(last_upload_time)}")
-                        upload_success = True
-                        break
-                    except Exception as e:
-                        with upload_stats_lock:
-                            upload_stats["failed"] += 1
-                            upload_stats["total_attempts"] += 1
-                        print(f"[{thread_name}] !!! ARKIV FAIL  | ID: {item.image_id} | Attempt {attempt}/{MAX_UPLOAD_RETRIES} | {e}")
-                        print(f"[{thread_name}] {get_upload_stats_summary()}")
-                        if attempt < MAX_UPLOAD_RETRIES:
-                            print(f"[{thread_name}]     Retry in {RETRY_DELAY}s...")
-                            # Wait with periodic shutdown checks
-                            for _ in range(RETRY_DELAY):
-                                if shutdown_event.is_set():
-                                    break
-                                time.sleep(1)
-                            if shutdown_event.is_set():
-                                # Mark back to generated for retry on next run
-                                mark_generated(item.prompt_id, item.image_path)
-                                break
-
-                if not upload_success:
-                    print(f"[{thread_name}] !!! ARKIV GAVE UP | ID: {item.image_id} | Will retry on next run !!!")
-                    mark_generated(item.prompt_id, item.image_path)
-
-        finally:
+            try:
+                prepared = prepare_upload(item, thread_name)
+            except Exception as e:
+                # Item stays 'generated' in the database and is retried on next run
+                print(f"[{thread_name}] !!! PREPARE FAIL | ID: {item.image_id} | {e}")
+                prepared = None
+            if prepared is None:
+                upload_queue.task_done()
+                continue
+
+            item_bytes = len(prepared.image_bytes) + ENTITY_OVERHEAD_KB * 1024
+            if batch and batch_bytes + item_bytes > UPLOAD_BATCH_KB * 1024:
+                # Doesn't fit, start the next batch with it
+                carry = prepared
+                break
+            batch.append(prepared)
+            batch_bytes += item_bytes
+
+        if batch and not shutdown_event.is_set():
+            try:
+                upload_pool.submit(process_upload, batch, upload_slots)
+                continue
+            except RuntimeError:
+                # Pool already shut down after an interrupt
+                pass
+
+        # Nothing to upload, or interrupted while waiting for a worker - images stay 'generated' for next run
+        for _ in batch:
             upload_queue.task_done()
+        upload_slots.release()
+        if shutdown_event.is_set():
+            finished = True
+
+    if carry:
+        upload_queue.task_done()
 
     print(f"[{thread_name}] Finished")
 
@@ -456,15 +682,14 @@ def run_threaded_generator():
     """Run image generation with multiple threads (optimized mode).
 
     - Generator thread: GPU work (generate images)
-    - Multiple uploader threads: Network I/O (upload to ARKIV in parallel)
+    - Upload dispatcher + worker pool: Network I/O (upload to ARKIV in parallel)
 
     GPU doesn't wait for uploads, maximizing utilization.
     """
     global shutdown_event
 
-    theme = get_theme()
     print("=" * 60)
-    print(f"THREADED {theme['name'].upper()} IMAGE GENERATOR")
+    print(f"THREADED {THEME['name'].upper()} IMAGE GENERATOR")
     print("=" * 60)
 
     # Initialize and seed database if needed
@@ -489,16 +714,14 @@ def run_threaded_generator():
         pending_items = get_all_generated()
         if pending_items:
             print(f"\n[Main] Loading {len(pending_items)} pending uploads from previous run...")
-            output_prefix = get_output_prefix()
             for item in pending_items:
-                # Extract image_id from filename (e.g., "output/ccats_5503.png" -> 5503)
-                filename = os.path.basename(item['filename'])
-                image_id = int(filename.replace(f"{output_prefix}_", "").replace(".png", ""))
+                # image_id is the prompt id (files are output/<prefix>_<id>.png or .jpg)
                 upload_queue.put(GeneratedImage(
                     prompt_id=item['id'],
                     prompt_text=item['prompt'],
                     image_path=item['filename'],
-                    image_id=image_id
+                    image_id=item['id'],
+                    content_type=get_content_type(item['filename'])
                 ))
             print(f"[Main] Loaded {len(pending_items)} items into upload queue")
 
@@ -506,13 +729,16 @@ def run_threaded_generator():
     gen_thread = threading.Thread(target=generator_thread, name="Generator")
     gen_thread.start()
 
-    # Start multiple uploader threads
-    upl_threads = []
+    # Start upload worker pool and the dispatcher feeding it
+    upload_pool = None
+    dispatcher = None
     if UPLOAD_TO_ARKIV:
-        for i in range(UPLOADER_THREADS):
-            t = threading.Thread(target=uploader_thread, name=f"Uploader-{i+1}")
-            t.start()
-            upl_threads.append(t)
+        upload_pool = ThreadPoolExecutor(max_workers=UPLOADER_THREADS, thread_name_prefix="Uploader")
+        upload_slots = threading.BoundedSemaphore(UPLOADER_THREADS)
+        dispatcher = threading.Thread(
+            target=upload_dispatcher, args=(upload_pool, upload_slots), name="Upload-Dispatcher"
+        )
+        dispatcher.start()
 
     try:
         # Wait for generator to finish
@@ -520,27 +746,31 @@ def run_threaded_generator():
 
         # Wait for all uploads to complete
         if UPLOAD_TO_ARKIV:
-            print(f"\n[Main] Generator finished, waiting for {len(upl_threads)} uploaders to complete...")
-            upload_queue.join()
-
-        # Signal uploaders to stop
-        shutdown_event.set()
-
-        # Wait for all uploader threads to finish
-        for t in upl_threads:
-            t.join(timeout=10)
+            print(f"\n[Main] Generator finished, waiting for {UPLOADER_THREADS} uploaders to complete...")
+            upload_queue.put(None)
+            dispatcher.join()
+            upload_pool.shutdown(wait=True)
 
     except KeyboardInterrupt:
         print("\n\n[Main] Interrupted by user, shutting down gracefully...")
         shutdown_event.set()
 
-        # Wait for threads to finish current work
+        # Wait for threads to finish current work, queued batches stay 'generated' for next run
         gen_thread.join(timeout=5)
-        for t in upl_threads:
-            t.join(timeout=10)
+        if UPLOAD_TO_ARKIV:
+            # Wake the dispatcher if it waits on an empty queue (a full queue wakes it anyway)
+            try:
+                upload_queue.put_nowait(None)
+            except queue.Full:
+                pass
+            dispatcher.join(timeout=10)
+            upload_pool.shutdown(wait=False, cancel_futures=True)
 
         print("[Main] Threads stopped")
 
+    # Write status updates still waiting in the batcher
+    status_batcher.flush()
+
     # Final stats
     stats = get_stats()
     print("\n" + "=" * 60)
@@ -552,12 +782,15 @@ def run_threaded_generator():
     if stats['pending'] > 0:
         print(f"Pending: {stats['pending']}")
 
+    # Close the database so the WAL is checkpointed and the -wal/-shm files removed
+    close_readers()
+    close_pools()
+
 
 def run_endless_generator():
     """Run endless image generation from database."""
-    theme = get_theme()
     print("=" * 60)
-    print(f"ENDLESS {theme['name'].upper()} IMAGE GENERATOR")
+    print(f"ENDLESS {THEME['name'].upper()} IMAGE GENERATOR")
     print("=" * 60)
 
     # Initialize and seed database if needed
@@ -574,8 +807,8 @@ def run_endless_generator():
     generation_count = 0
 
     while True:
-        # Get next prompt
-        item = get_next_prompt()
+        # Get next prompt, marked in progress
+        item = claim_next_prompt()
 
         if not item:
             print("\n" + "=" * 60)
@@ -593,9 +826,6 @@ def run_endless_generator():
         print(f"\n[{stats['completed'] + 1}/{stats['total']}] Generating...")
         print(f"Prompt: {prompt_text[:80]}...")
 
-        # Mark as in progress
-        mark_in_progress(prompt_id)
-
         try:
             # Generate the image
             output_path = generate_image(prompt_text, image_id)
@@ -625,6 +855,10 @@ def run_endless_generator():
     stats = get_stats()
     print(f"\nFinal stats: {stats['completed']}/{stats['total']} completed ({stats['progress_percent']:.1f}%)")
 
+    # Close the database so the WAL is checkpointed and the -wal/-shm files removed
+    close_readers()
+    close_pools()
+
 
 if __name__ == "__main__":
     import sys
@@ -1,7 +1,12 @@
-import itertools
+import atexit
+import json
 import random
+import itertools
 import sqlite3
 import os
+import threading
+import queue
+from contextlib import contextmanager
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -138,202 +143,553 @@ SHARED_QUALITY = [
     "studio lighting, professional",
 ]
 
+# Prompt combinations per theme (the lists above don't change at runtime)
+_SHARED_COMBOS = len(SHARED_STYLES) * len(SHARED_COLORS) * len(SHARED_BACKGROUNDS) * len(SHARED_QUALITY)
+THEME_COMBO_COUNTS = {
+    key: len(theme["subjects"]) * len(theme["accessories"]) * _SHARED_COMBOS
+    for key, theme in THEMES.items()
+}
+
+# Shared prompt endings (style x color x background x quality) in combination order,
+# the same for every theme, so they are built once
+SHARED_TAILS = [
+    f"{style}, {color}, {bg}, {quality}" if bg else f"{style}, {color}, {quality}"
+    for style in SHARED_STYLES
+    for color in SHARED_COLORS
+    for bg in SHARED_BACKGROUNDS
+    for quality in SHARED_QUALITY
+]
+
 
 # =============================================================================
 # HELPER FUNCTIONS
 # =============================================================================
 
+# Active theme settings, resolved once by _activate() (None for an unknown theme)
+_THEME = None
+_DB_PATH = None
+_APP_NAME = None
+_OUTPUT_PREFIX = None
+# Prompt heads (subject x accessory, see get_prompt_parts) and accessory count of the active theme
+_HEADS = None
+_ACCESSORY_COUNT = None
+
+
+def _build_heads(theme: dict) -> list:
+    """Build the subject x accessory prompt heads of a theme, in combination order."""
+    return [
+        f"a {subject}, {accessory}" if accessory else f"a {subject}"
+        for subject in theme["subjects"]
+        for accessory in theme["accessories"]
+    ]
+
+
+def _activate(theme_key: str):
+    """Make theme_key the active theme (at import, and by the CLI theme argument)."""
+    global ACTIVE_THEME, _THEME, _DB_PATH, _APP_NAME, _OUTPUT_PREFIX, _HEADS, _ACCESSORY_COUNT
+    ACTIVE_THEME = theme_key
+    _THEME = THEMES.get(theme_key)
+    _DB_PATH = _THEME["db_path"] if _THEME else None
+    _APP_NAME = _THEME["app_name"] if _THEME else None
+    _OUTPUT_PREFIX = _THEME["output_prefix"] if _THEME else None
+    _HEADS = _build_heads(_THEME) if _THEME else None
+    _ACCESSORY_COUNT = len(_THEME["accessories"]) if _THEME else None
+
+
+def _check_theme():
+    """Raise ValueError if the active theme is unknown."""
+    if _THEME is None:
+        raise ValueError(f"Unknown theme: {ACTIVE_THEME}. Available: {list(THEMES.keys())}")
+
+
 def get_theme():
     """Get the currently active theme configuration."""
-    if ACTIVE_THEME not in THEMES:
-        raise ValueError(f"Unknown theme: {ACTIVE_THEME}. Available: {list(THEMES.keys())}")
-    return THEMES[ACTIVE_THEME]
+    _check_theme()
+    return _THEME
 
 
 def get_db_path():
     """Get database path for current theme."""
-    return get_theme()["db_path"]
+    _check_theme()
+    return _DB_PATH
 
 
 def get_app_name():
     """Get app name for ARKIV uploads."""
-    return get_theme()["app_name"]
+    _check_theme()
+    return _APP_NAME
 
 
 def get_output_prefix():
     """Get output filename prefix."""
-    return get_theme()["output_prefix"]
+    _check_theme()
+    return _OUTPUT_PREFIX
+
+
+_activate(ACTIVE_THEME)
 
 
 # =============================================================================
 # DATABASE FUNCTIONS
 # =============================================================================
 
-def init_db():
-    """Initialize SQLite database for tracking generations."""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
-    cursor.execute("""
+# Long-lived connections per database file, borrowed for one call or transaction.
+# Sized for threaded mode: generator, prompt prefetch, upload dispatcher, uploaders, main.
+POOL_SIZE = 8
+_POOLS: dict[str, queue.Queue] = {}
+_POOLS_LOCK = threading.Lock()
+
+# Read-only connections for the read helpers, one per thread and database file, kept
+# for the thread's lifetime. In WAL mode they never block (or wait for) writers.
+_readers = threading.local()
+# Every open reader as (owning thread's conns dict, db_path, connection), for close_readers()
+_READER_REGISTRY = []
+_READER_REGISTRY_LOCK = threading.Lock()
+
+# Rows store the index of each prompt component, not the prompt text - the text is
+# built on read (prompt_from_indices). Theme and shared lists may only be appended to,
+# otherwise stored indices point at different components - init_db() checks this
+# against the lists recorded in the meta table.
+_COMPONENT_NAMES = ("subject", "accessory", "style", "color", "background", "quality")
+_COMPONENT_COLUMNS = ", ".join(_COMPONENT_NAMES)
+
+# Hot-path statements, passed as the same string every call so sqlite3's
+# per-connection statement cache (cached_statements) reuses the compiled statement
+_SQL_NEXT_PENDING = (
+    f"SELECT id, {_COMPONENT_COLUMNS} FROM generations WHERE status = 'pending' ORDER BY sort_key, id LIMIT 1"
+)
+_SQL_CLAIM_NEXT = (
+    "UPDATE generations SET status = 'in_progress' WHERE id = ("
+    "SELECT id FROM generations WHERE status = 'pending' ORDER BY sort_key, id LIMIT 1"
+    f") RETURNING id, {_COMPONENT_COLUMNS}"
+)
+_SQL_MARK_IN_PROGRESS = "UPDATE generations SET status = 'in_progress' WHERE id = ?"
+_SQL_MARK_COMPLETED = (
+    "UPDATE generations SET status = 'completed', filename = ?, completed_at = CURRENT_TIMESTAMP WHERE id = ?"
+)
+_SQL_MARK_FAILED = "UPDATE generations SET status = 'pending' WHERE id = ?"
+_SQL_MARK_GENERATED = "UPDATE generations SET status = 'generated', filename = ? WHERE id = ?"
+
+# Durability: the database runs in WAL mode (set once in init_db, stored in the file)
+# with synchronous=NORMAL, so commits don't fsync - only WAL checkpoints do.
+# The database stays consistent after a crash or power loss; only the last few
+# commits can be lost, which just means those prompts are generated/uploaded again.
+
+
+def _connect(db_path: str, read_only: bool = False) -> sqlite3.Connection:
+    """Open an autocommit connection with the per-connection PRAGMAs applied."""
+    if read_only:
+        database, uri = f"{Path(db_path).absolute().as_uri()}?mode=ro", True
+    else:
+        database, uri = db_path, False
+    conn = sqlite3.connect(
+        database, timeout=30.0, isolation_level=None, check_same_thread=False, cached_statements=256, uri=uri
+    )
+    if not read_only:
+        # Only writers commit and checkpoint
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA wal_autocheckpoint=1000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")     # 64MB page cache
+    conn.execute("PRAGMA mmap_size=268435456")   # 256MB memory-mapped reads
+    return conn
+
+
+@contextmanager
+def borrow_conn(db_path: str = None):
+    """Borrow a pooled connection (autocommit) for the current theme's database.
+
+    A new connection is opened when the pool is empty; connections beyond
+    POOL_SIZE are closed on return.
+    """
+    db_path = db_path or get_db_path()
+    with _POOLS_LOCK:
+        pool = _POOLS.setdefault(db_path, queue.Queue(maxsize=POOL_SIZE))
+
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _connect(db_path)
+
+    try:
+        yield conn
+    finally:
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+def close_pools():
+    """Close the pooled connections of every database.
+
+    The last connection to close checkpoints the WAL and removes the -wal/-shm
+    files. Connections borrowed later reopen the pool.
+    """
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def _create_table(conn: sqlite3.Connection):
+    """Create the generations table (one row per component index combination)."""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS generations (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            prompt TEXT UNIQUE NOT NULL,
+            subject INTEGER NOT NULL,
+            accessory INTEGER NOT NULL,
+            style INTEGER NOT NULL,
+            color INTEGER NOT NULL,
+            background INTEGER NOT NULL,
+            quality INTEGER NOT NULL,
             status TEXT DEFAULT 'pending',
             filename TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            completed_at TIMESTAMP
+            completed_at TIMESTAMP,
+            sort_key INTEGER
         )
     """)
-    conn.commit()
-    conn.close()
 
 
-def generate_all_prompts():
-    """Generate all possible prompt combinations for current theme."""
+def _create_indexes(conn: sqlite3.Connection):
+    """Create the generations indexes (no-op for the ones that exist)."""
+    # One row per combination
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_gen_components ON generations({_COMPONENT_COLUMNS})")
+    # Status lookups (next pending in processing order, resets, stats) seek this index instead of scanning
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_gen_status_sort ON generations(status, sort_key)")
+
+
+def _drop_indexes(conn: sqlite3.Connection):
+    """Drop the indexes created by _create_indexes()."""
+    conn.execute("DROP INDEX IF EXISTS idx_gen_components")
+    conn.execute("DROP INDEX IF EXISTS idx_gen_status_sort")
+
+
+def _migrate_prompt_text(conn: sqlite3.Connection):
+    """Convert a database that stores prompt text to component indices.
+
+    Ids, status, filenames, timestamps and processing order are kept. Prompts
+    that are no longer combinations of the current theme lists are moved, as
+    they are, to the generations_legacy table instead of being converted.
+    """
     theme = get_theme()
-    subjects = theme["subjects"]
-    accessories = theme["accessories"]
+    heads, tails = get_prompt_parts()
+    head_indices = dict(zip(heads, itertools.product(
+        range(len(theme["subjects"])), range(len(theme["accessories"]))
+    )))
+    tail_indices = dict(zip(tails, itertools.product(
+        range(len(SHARED_STYLES)), range(len(SHARED_COLORS)),
+        range(len(SHARED_BACKGROUNDS)), range(len(SHARED_QUALITY)),
+    )))
+
+    def to_indices(prompt: str):
+        # Components may contain ", " themselves, so try every split point
+        pos = prompt.find(", ")
+        while pos >= 0:
+            head = head_indices.get(prompt[:pos])
+            if head is not None:
+                tail = tail_indices.get(prompt[pos + 2:])
+                if tail is not None:
+                    return head + tail
+            pos = prompt.find(", ", pos + 1)
+        return None
+
+    unmatched = 0
+
+    def converted_rows(rows):
+        nonlocal unmatched
+        for prompt_id, prompt, *state in rows:
+            indices = to_indices(prompt)
+            if indices is None:
+                unmatched += 1
+                continue
+            yield (prompt_id, *indices, *state)
+
+    print(f"[{theme['name']}] Migrating database from prompt text to component indices...")
+    conn.execute("BEGIN")
+    try:
+        conn.execute("ALTER TABLE generations RENAME TO generations_text")
+        _create_table(conn)
+        rows = conn.execute(
+            "SELECT id, prompt, status, filename, created_at, completed_at, sort_key FROM generations_text"
+        )
+        conn.executemany(
+            f"""INSERT INTO generations (id, {_COMPONENT_COLUMNS}, status, filename, created_at, completed_at, sort_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            converted_rows(rows)
+        )
+        if unmatched:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS generations_legacy (
+                    id INTEGER PRIMARY KEY,
+                    prompt TEXT NOT NULL,
+                    status TEXT,
+                    filename TEXT,
+                    created_at TIMESTAMP,
+                    completed_at TIMESTAMP,
+                    sort_key INTEGER
+                )
+            """)
+            conn.execute("""
+                INSERT OR REPLACE INTO generations_legacy
+                SELECT id, prompt, status, filename, created_at, completed_at, sort_key FROM generations_text
+                WHERE id NOT IN (SELECT id FROM generations)
+            """)
+        # Keep the id sequence, so ids of unmatched rows (and their output files) are never reused
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'generations'")
+        conn.execute("UPDATE sqlite_sequence SET name = 'generations' WHERE name = 'generations_text'")
+        conn.execute("DROP TABLE generations_text")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    # Give the space of the text column back to the filesystem
+    conn.execute("VACUUM")
+    if unmatched:
+        print(f"[{theme['name']}] Moved {unmatched} prompts that are not in the current theme lists "
+              f"to the generations_legacy table, they are not generated or uploaded")
+
+
+def _reader() -> sqlite3.Connection:
+    """Get this thread's read-only connection for the current theme's database."""
+    db_path = get_db_path()
+    conns = getattr(_readers, "conns", None)
+    if conns is None:
+        conns = _readers.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = conns[db_path] = _connect(db_path, read_only=True)
+        with _READER_REGISTRY_LOCK:
+            _READER_REGISTRY.append((conns, db_path, conn))
+    return conn
+
+
+def close_readers():
+    """Close the read-only connections of all threads.
+
+    Call before close_pools() at shutdown: read-only connections can't
+    checkpoint, so the WAL is only removed once a writer closes last.
+    A thread that reads again afterwards opens a new connection.
+    """
+    with _READER_REGISTRY_LOCK:
+        readers = _READER_REGISTRY[:]
+        _READER_REGISTRY.clear()
+    for conns, db_path, conn in readers:
+        conns.pop(db_path, None)
+        conn.close()
+
+
+def _check_component_lists(conn: sqlite3.Connection):
+    """Make sure stored component indices still match the current lists, then record them.
+
+    Each list recorded in the meta table must be a prefix of the current one (lists
+    are append-only). Databases without a record are checked by their largest
+    stored index instead. Raises ValueError on a mismatch, before any row is touched.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    current = {name: list(values) for name, values in zip(_COMPONENT_NAMES, get_component_lists())}
+
+    row = conn.execute("SELECT value FROM meta WHERE key = 'component_lists'").fetchone()
+    if row is not None:
+        recorded = json.loads(row[0])
+        for name, values in current.items():
+            stored = recorded.get(name, [])
+            if values[:len(stored)] != stored:
+                raise ValueError(
+                    f"Prompt {name} list no longer matches {get_db_path()}: entries among the "
+                    f"first {len(stored)} were changed or removed. Lists may only be appended "
+                    f"to - restore the list or use a new database."
+                )
+        if recorded == current:
+            return
+    else:
+        columns = ", ".join(f"MAX({name})" for name in _COMPONENT_NAMES)
+        maxima = conn.execute(f"SELECT {columns} FROM generations").fetchone()
+        for name, largest in zip(_COMPONENT_NAMES, maxima):
+            if largest is not None and largest >= len(current[name]):
+                raise ValueError(
+                    f"Prompt {name} list has {len(current[name])} entries but {get_db_path()} "
+                    f"references index {largest}. Lists may only be appended to - restore the "
+                    f"list or use a new database."
+                )
+
+    conn.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES ('component_lists', ?)", (json.dumps(current),)
+    )
+
+
+def init_db():
+    """Initialize SQLite database for tracking generations."""
+    with borrow_conn() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        _create_table(conn)
+
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(generations)")]
+        if "prompt" in columns:
+            # Databases created before sort_key existed were seeded in shuffled id order:
+            # sort_key stays NULL there, so prompts keep being processed by id
+            if "sort_key" not in columns:
+                conn.execute("ALTER TABLE generations ADD COLUMN sort_key INTEGER")
+            _migrate_prompt_text(conn)
+
+        _check_component_lists(conn)
+
+        conn.execute("DROP INDEX IF EXISTS idx_gen_status_id")
+        _create_indexes(conn)
+        conn.execute("PRAGMA optimize")
+
+
+def get_component_lists():
+    """Get the prompt component lists for current theme, in combination order."""
+    theme = get_theme()
+    return (
+        theme["subjects"], theme["accessories"],
+        SHARED_STYLES, SHARED_COLORS, SHARED_BACKGROUNDS, SHARED_QUALITY,
+    )
+
+
+def get_combination_count() -> int:
+    """Get number of prompt combinations for current theme."""
+    _check_theme()
+    return THEME_COMBO_COUNTS[ACTIVE_THEME]
+
+
+def get_prompt_parts():
+    """Get (heads, tails) for current theme - every prompt is f"{head}, {tail}".
+
+    Heads cover subject x accessory, tails (SHARED_TAILS) cover style x color x
+    background x quality, both in combination order.
+    """
+    _check_theme()
+    return _HEADS, SHARED_TAILS
+
+
+def prompt_from_indices(subject: int, accessory: int, style: int, color: int, background: int, quality: int) -> str:
+    """Build the prompt text for a row's component indices."""
+    _check_theme()
+    head = subject * _ACCESSORY_COUNT + accessory
+    tail = ((style * len(SHARED_COLORS) + color) * len(SHARED_BACKGROUNDS) + background) * len(SHARED_QUALITY) + quality
+    return f"{_HEADS[head]}, {SHARED_TAILS[tail]}"
 
-    prompts = []
-    for subject, accessory, style, color, bg, quality in itertools.product(
-        subjects, accessories, SHARED_STYLES, SHARED_COLORS, SHARED_BACKGROUNDS, SHARED_QUALITY
-    ):
-        parts = [f"a {subject}"]
-        if accessory:
-            parts.append(accessory)
-        parts.extend([style, color])
-        if bg:
-            parts.append(bg)
-        parts.append(quality)
 
-        prompt = ", ".join(parts)
-        prompts.append(prompt)
+def iter_component_indices():
+    """Yield the component indices of every combination, in combination order."""
+    return itertools.product(*(range(len(values)) for values in get_component_lists()))
 
-    return prompts
+
+def prompt_at_index(index: int) -> str:
+    """Build the prompt at position `index` of the combination product, without building the others."""
+    heads, tails = get_prompt_parts()
+    head, tail = divmod(index, len(tails))
+    return f"{heads[head]}, {tails[tail]}"
 
 
 def seed_database(shuffle: bool = True):
-    """Populate database with all prompt combinations."""
-    init_db()
-    prompts = generate_all_prompts()
+    """Populate database with all prompt combinations.
 
-    if shuffle:
-        random.shuffle(prompts)
+    Combinations are inserted as component indices in combination order. With
+    shuffle, each row gets a random sort_key and get_next_prompt() follows that
+    order; otherwise sort_key stays NULL and prompts are processed by id.
+    Nothing is inserted if the database already holds every combination.
+    """
+    init_db()
 
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
+    theme = get_theme()
+    existing = _reader().execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+    if existing == get_combination_count():
+        stats = get_stats()
+        print(f"[{theme['name']}] Database already seeded: {stats['total']} total prompts, "
+              f"{stats['pending']} pending, {stats['completed']} completed")
+        return stats["total"]
 
-    # Insert prompts, ignore if already exists
-    for prompt in prompts:
+    if shuffle:
+        insert_sql = f"INSERT OR IGNORE INTO generations ({_COMPONENT_COLUMNS}, sort_key) VALUES (?, ?, ?, ?, ?, ?, abs(random()))"
+    else:
+        insert_sql = f"INSERT OR IGNORE INTO generations ({_COMPONENT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)"
+
+    with borrow_conn() as conn:
+        # Insert prompts in a single transaction, duplicates are ignored.
+        # executemany pulls rows from the generator one at a time, so memory stays flat.
+        conn.execute("BEGIN")
         try:
-            cursor.execute(
-                "INSERT OR IGNORE INTO generations (prompt) VALUES (?)",
-                (prompt,)
-            )
-        except sqlite3.IntegrityError:
-            pass
+            # First seed: build the indexes once from the loaded table instead of updating them per row
+            first_seed = conn.execute("SELECT 1 FROM generations LIMIT 1").fetchone() is None
+            if first_seed:
+                _drop_indexes(conn)
 
-    conn.commit()
+            conn.executemany(insert_sql, iter_component_indices())
 
-    # Get stats
-    cursor.execute("SELECT COUNT(*) FROM generations")
-    total = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM generations WHERE status = 'pending'")
-    pending = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM generations WHERE status = 'completed'")
-    completed = cursor.fetchone()[0]
+            if first_seed:
+                _create_indexes(conn)
+        except BaseException:
+            # Don't return the connection to the pool inside an open transaction
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
 
-    conn.close()
+    # Get stats
+    stats = get_stats()
+    total, pending, completed = stats["total"], stats["pending"], stats["completed"]
 
-    theme = get_theme()
     print(f"[{theme['name']}] Database seeded: {total} total prompts, {pending} pending, {completed} completed")
     return total
 
 
 def get_next_prompt():
     """Get next pending prompt from database."""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
+    result = _reader().execute(_SQL_NEXT_PENDING).fetchone()
+
+    if result:
+        return {"id": result[0], "prompt": prompt_from_indices(*result[1:])}
+    return None
 
-    cursor.execute("""
-        SELECT id, prompt FROM generations
-        WHERE status = 'pending'
-        ORDER BY id
-        LIMIT 1
-    """)
-    result = cursor.fetchone()
-    conn.close()
+
+def claim_next_prompt():
+    """Get next pending prompt and mark it in progress in one statement (needs SQLite 3.35+)."""
+    with borrow_conn() as conn:
+        result = conn.execute(_SQL_CLAIM_NEXT).fetchone()
 
     if result:
-        return {"id": result[0], "prompt": result[1]}
+        return {"id": result[0], "prompt": prompt_from_indices(*result[1:])}
     return None
 
 
 def mark_in_progress(prompt_id: int):
     """Mark a prompt as in progress."""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE generations SET status = 'in_progress' WHERE id = ?",
-        (prompt_id,)
-    )
-    conn.commit()
-    conn.close()
+    with borrow_conn() as conn:
+        conn.execute(_SQL_MARK_IN_PROGRESS, (prompt_id,))
 
 
 def mark_completed(prompt_id: int, filename: str):
     """Mark a prompt as completed with the output filename."""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
-    cursor.execute(
-        """UPDATE generations
-           SET status = 'completed', filename = ?, completed_at = CURRENT_TIMESTAMP
-           WHERE id = ?""",
-        (filename, prompt_id)
-    )
-    conn.commit()
-    conn.close()
+    with borrow_conn() as conn:
+        conn.execute(_SQL_MARK_COMPLETED, (filename, prompt_id))
 
 
 def mark_failed(prompt_id: int):
     """Mark a prompt as failed (will be retried)."""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE generations SET status = 'pending' WHERE id = ?",
-        (prompt_id,)
-    )
-    conn.commit()
-    conn.close()
+    with borrow_conn() as conn:
+        conn.execute(_SQL_MARK_FAILED, (prompt_id,))
 
 
 def get_stats():
     """Get generation statistics."""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT COUNT(*) FROM generations")
-    total = cursor.fetchone()[0]
-
-    cursor.execute("SELECT COUNT(*) FROM generations WHERE status = 'pending'")
-    pending = cursor.fetchone()[0]
-
-    cursor.execute("SELECT COUNT(*) FROM generations WHERE status = 'completed'")
-    completed = cursor.fetchone()[0]
-
-    cursor.execute("SELECT COUNT(*) FROM generations WHERE status = 'in_progress'")
-    in_progress = cursor.fetchone()[0]
+    # Single grouped scan (covered by idx_gen_status_sort) instead of one COUNT query per status
+    counts = dict(_reader().execute(
+        "SELECT status, COUNT(*) FROM generations GROUP BY status"
+    ).fetchall())
 
-    cursor.execute("SELECT COUNT(*) FROM generations WHERE status = 'generated'")
-    generated = cursor.fetchone()[0]
-
-    conn.close()
+    total = sum(counts.values())
+    pending = counts.get("pending", 0)
+    completed = counts.get("completed", 0)
+    in_progress = counts.get("in_progress", 0)
+    generated = counts.get("generated", 0)
 
     return {
         "total": total,
@@ -350,15 +706,11 @@ def reset_in_progress():
 
     Note: This is the legacy function. For threaded mode, use reset_interrupted().
     """
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE generations SET status = 'pending' WHERE status = 'in_progress'"
-    )
-    affected = cursor.rowcount
-    conn.commit()
-    conn.close()
+    with borrow_conn() as conn:
+        cursor = conn.execute(
+            "UPDATE generations SET status = 'pending' WHERE status = 'in_progress'"
+        )
+        affected = cursor.rowcount
 
     if affected > 0:
         print(f"Reset {affected} interrupted generations back to pending")
@@ -371,63 +723,38 @@ def reset_in_progress():
 
 def mark_generated(prompt_id: int, filename: str):
     """Mark a prompt as generated (image created, ready for upload)."""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE generations SET status = 'generated', filename = ? WHERE id = ?",
-        (filename, prompt_id)
-    )
-    conn.commit()
-    conn.close()
+    with borrow_conn() as conn:
+        conn.execute(_SQL_MARK_GENERATED, (filename, prompt_id))
 
 
 def get_next_generated():
     """Get next item ready for upload (status='generated')."""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT id, prompt, filename FROM generations
+    result = _reader().execute(f"""
+        SELECT id, filename, {_COMPONENT_COLUMNS} FROM generations
         WHERE status = 'generated'
-        ORDER BY id
+        ORDER BY sort_key, id
         LIMIT 1
-    """)
-    result = cursor.fetchone()
-    conn.close()
+    """).fetchone()
 
     if result:
-        return {"id": result[0], "prompt": result[1], "filename": result[2]}
+        return {"id": result[0], "prompt": prompt_from_indices(*result[2:]), "filename": result[1]}
     return None
 
 
 def get_generated_count():
     """Get count of items waiting for upload."""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM generations WHERE status = 'generated'")
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    return _reader().execute("SELECT COUNT(*) FROM generations WHERE status = 'generated'").fetchone()[0]
 
 
 def get_all_generated():
-    """Get all items ready for upload (status='generated'), ordered by ID."""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT id, prompt, filename FROM generations
+    """Get all items ready for upload (status='generated'), in processing order."""
+    results = _reader().execute(f"""
+        SELECT id, filename, {_COMPONENT_COLUMNS} FROM generations
         WHERE status = 'generated'
-        ORDER BY id
-    """)
-    results = cursor.fetchall()
-    conn.close()
+        ORDER BY sort_key, id
+    """).fetchall()
 
-    return [{"id": r[0], "prompt": r[1], "filename": r[2]} for r in results]
+    return [{"id": r[0], "prompt": prompt_from_indices(*r[2:]), "filename": r[1]} for r in results]
 
 
 def reset_interrupted():
@@ -436,22 +763,15 @@ def reset_interrupted():
     - 'in_progress' -> 'pending' (generation was interrupted)
     - 'generated' items stay as-is (image exists, just needs upload)
     """
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path, timeout=30.0)
-    cursor = conn.cursor()
-
-    # Reset interrupted generations
-    cursor.execute(
-        "UPDATE generations SET status = 'pending' WHERE status = 'in_progress'"
-    )
-    gen_reset = cursor.rowcount
-
-    # Count items waiting for upload
-    cursor.execute("SELECT COUNT(*) FROM generations WHERE status = 'generated'")
-    pending_uploads = cursor.fetchone()[0]
+    with borrow_conn() as conn:
+        # Reset interrupted generations
+        cursor = conn.execute(
+            "UPDATE generations SET status = 'pending' WHERE status = 'in_progress'"
+        )
+        gen_reset = cursor.rowcount
 
-    conn.commit()
-    conn.close()
+        # Count items waiting for upload
+        pending_uploads = conn.execute("SELECT COUNT(*) FROM generations WHERE status = 'generated'").fetchone()[0]
 
     if gen_reset > 0:
         print(f"Reset {gen_reset} interrupted generations back to pending")
@@ -461,15 +781,110 @@ def reset_interrupted():
     return {"gen_reset": gen_reset, "pending_uploads": pending_uploads}
 
 
+# =============================================================================
+# BATCHED STATUS UPDATES
+# =============================================================================
+
+STATUS_BATCH_SIZE = 20        # Flush once this many updates are queued
+STATUS_BATCH_INTERVAL = 5.0   # ...and at least this often (seconds)
+
+
+class StatusBatcher:
+    """Collects 'generated' / 'completed' status updates and writes them in one transaction.
+
+    Queued updates are written by a background flusher thread when the batch
+    is full and every `interval` seconds, so callers never wait on the database.
+    Only the latest update per prompt is kept, so 'generated' followed by
+    'completed' for the same prompt is written once as 'completed'.
+    Updates still queued when the process dies are lost: the prompt is
+    regenerated ('in_progress' -> 'pending') or re-uploaded ('generated').
+    """
+
+    def __init__(self, batch_size: int = STATUS_BATCH_SIZE, interval: float = STATUS_BATCH_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._pending = {}  # prompt_id -> (status, filename), in arrival order
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # One flush at a time, so an older batch can't commit over a newer one
+        self._wakeup = threading.Event()
+        self._flusher = None
+
+    def mark(self, prompt_id: int, status: str, filename: str = None):
+        """Queue a status update, waking the flusher if the batch is full."""
+        with self._lock:
+            self._pending.pop(prompt_id, None)
+            self._pending[prompt_id] = (status, filename)
+            full = len(self._pending) >= self.batch_size
+
+            # Started on first use, so importing the module doesn't start a thread
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name="Status-Flusher", daemon=True)
+                self._flusher.start()
+
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        """Flusher thread: write queued updates when woken or every interval."""
+        while True:
+            self._wakeup.wait(timeout=self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Updates were re-queued by flush(), next round retries them
+                print(f"[Status-Flusher] Flush failed: {e}")
+
+    def flush(self):
+        """Write all queued updates in a single transaction."""
+        with self._flush_lock:
+            pending = {}
+            try:
+                with self._lock:
+                    pending, self._pending = self._pending, {}
+
+                if not pending:
+                    return
+
+                with borrow_conn() as conn:
+                    conn.execute("BEGIN")
+                    try:
+                        conn.executemany(
+                            """UPDATE generations
+                               SET status = :status,
+                                   filename = COALESCE(:filename, filename),
+                                   completed_at = CASE WHEN :status = 'completed' THEN CURRENT_TIMESTAMP ELSE completed_at END
+                               WHERE id = :id""",
+                            (
+                                {"id": prompt_id, "status": status, "filename": filename}
+                                for prompt_id, (status, filename) in pending.items()
+                            )
+                        )
+                        conn.execute("COMMIT")
+                    except BaseException:
+                        # Don't return the connection to the pool inside an open transaction
+                        if conn.in_transaction:
+                            conn.execute("ROLLBACK")
+                        raise
+            except Exception:
+                # Put updates back unless a newer one arrived meanwhile
+                with self._lock:
+                    for prompt_id, update in pending.items():
+                        self._pending.setdefault(prompt_id, update)
+                raise
+
+
+# Shared batcher used by the generator and uploader threads, flushed on normal exit as well
+status_batcher = StatusBatcher()
+atexit.register(status_batcher.flush)
+
+
 def list_themes():
     """List all available themes."""
     print("Available themes:")
     for key, theme in THEMES.items():
         marker = " (ACTIVE)" if key == ACTIVE_THEME else ""
-        subjects_count = len(theme["subjects"])
-        accessories_count = len(theme["accessories"])
-        total = subjects_count * accessories_count * len(SHARED_STYLES) * len(SHARED_COLORS) * len(SHARED_BACKGROUNDS) * len(SHARED_QUALITY)
-        print(f"  - {key}: {theme['name']} ({total:,} combinations){marker}")
+        print(f"  - {key}: {theme['name']} ({THEME_COMBO_COUNTS[key]:,} combinations){marker}")
 
 
 if __name__ == "__main__":
@@ -479,7 +894,7 @@ if __name__ == "__main__":
     if len(sys.argv) > 1:
         requested_theme = sys.argv[1]
         if requested_theme in THEMES:
-            ACTIVE_THEME = requested_theme
+            _activate(requested_theme)
         elif requested_theme == "--list":
             list_themes()
             sys.exit(0)
@@ -493,7 +908,7 @@ if __name__ == "__main__":
     # Show what we can generate
     subjects = theme["subjects"]
     accessories = theme["accessories"]
-    total = len(subjects) * len(accessories) * len(SHARED_STYLES) * len(SHARED_COLORS) * len(SHARED_BACKGROUNDS) * len(SHARED_QUALITY)
+    total = get_combination_count()
 
     print(f"Theme: {theme['name']}")
     print(f"App name: {theme['app_name']}")
@@ -509,9 +924,8 @@ if __name__ == "__main__":
     print(f"  - Quality tags: {len(SHARED_QUALITY)}")
 
     print(f"\nExample prompts:")
-    prompts = generate_all_prompts()
-    for p in random.sample(prompts, min(5, len(prompts))):
-        print(f"  - {p[:100]}...")
+    for index in random.sample(range(total), min(5, total)):
+        print(f"  - {prompt_at_index(index)[:100]}...")
 
     print(f"\n" + "=" * 40)
     list_themes()